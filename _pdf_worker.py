@@ -0,0 +1,107 @@
+"""
+Generación del PDF combinado (TB + soporte recortado) de cada registro.
+
+Este módulo se ejecuta en los procesos worker de app_tbs.py. Está anotado con
+tipos para poder compilarlo de forma opcional con mypyc (ver README); si existe
+la versión compilada, Python la importa en lugar de este archivo.
+"""
+import os
+from typing import Dict, Tuple
+
+import fitz  # PyMuPDF
+
+# Opciones de guardado de los PDFs generados: el documento se acaba de construir,
+# así que no hace falta recolectar basura ni reescribir los contenidos. Los
+# streams copiados de los PDFs de origen conservan su compresión; solo se
+# comprimen las fuentes que vengan sin comprimir (deflate=True comprimiría todos
+# los streams sin comprimir, imágenes incluidas, con el costo de CPU que implica)
+PDF_SAVE_OPTIONS: Dict[str, object] = dict(garbage=0, deflate=False, deflate_images=False,
+                                           deflate_fonts=True, clean=False)
+
+# Documentos de origen abiertos en cada proceso worker: ruta -> ((mtime_ns,
+# tamaño), documento). El pool de procesos se comparte entre los trabajos en
+# curso, así que se conservan solo los últimos MAX_OPEN_DOCS y se reabren si el
+# archivo cambia; se cierran al terminar el proceso, cuando se cierra el pool
+MAX_OPEN_DOCS = 4
+_open_docs: Dict[str, Tuple[Tuple[int, int], fitz.Document]] = {}
+
+
+def source_doc(path: str) -> fitz.Document:
+    """
+    Devuelve el PDF de origen abierto en este proceso, abriéndolo si hace falta
+
+    Args:
+        path (str): Ruta del PDF de TBs o de soportes
+
+    Returns:
+        fitz.Document: Documento abierto, reutilizado entre tareas
+    """
+    st = os.stat(path)
+    key = (st.st_mtime_ns, st.st_size)
+    entry = _open_docs.pop(path, None)
+    if entry is not None:
+        if entry[0] == key:
+            _open_docs[path] = entry  # pasa a ser el más reciente
+            return entry[1]
+        entry[1].close()
+
+    doc = fitz.open(path)
+    _open_docs[path] = (key, doc)
+    while len(_open_docs) > MAX_OPEN_DOCS:
+        oldest = next(iter(_open_docs))
+        _open_docs.pop(oldest)[1].close()
+    return doc
+
+
+def emit_one(tb_path: str, soporte_path: str, i: int, num_egreso: str, safe_girado: str,
+             soporte_page_num: int, region: Tuple[float, float, float, float],
+             output_folder: str) -> str:
+    """
+    Genera el PDF combinado (TB + soporte recortado) de un registro
+
+    Args:
+        tb_path (str): Ruta del PDF de TBs (una TB por página)
+        soporte_path (str): Ruta del PDF de soportes
+        i (int): Índice del registro y de la página de TB correspondiente
+        num_egreso (str): Valor de "No Egreso" del registro
+        safe_girado (str): Valor de "Girado a" ya limpio para usarlo en el nombre
+        soporte_page_num (int): Página del PDF de soportes
+        region (tuple): Coordenadas (x0, y0, x1, y1) del soporte en la página
+        output_folder (str): Carpeta de salida para el PDF generado
+
+    Returns:
+        str: Ruta del archivo generado
+    """
+    # Crear nombre de archivo usando No Egreso y Girado a
+    output_path = os.path.join(output_folder, f"{num_egreso} - {safe_girado}.pdf")
+
+    # Crear el documento final combinado (se libera en cuanto se guarda); cada
+    # worker guarda sus propios archivos, en paralelo con los demás
+    with fitz.open() as final_doc:
+        append_record(final_doc, source_doc(tb_path), source_doc(soporte_path),
+                      i, soporte_page_num, region)
+        final_doc.save(output_path, **PDF_SAVE_OPTIONS)
+    return output_path
+
+
+def append_record(target_doc: fitz.Document, tb_doc: fitz.Document, soporte_doc: fitz.Document,
+                  i: int, soporte_page_num: int, region: Tuple[float, float, float, float]) -> None:
+    """
+    Agrega al final de un documento la TB de un registro y su soporte recortado
+
+    Args:
+        target_doc (fitz.Document): Documento al que se agregan las páginas
+        tb_doc (fitz.Document): Documento PDF de TBs (una TB por página)
+        soporte_doc (fitz.Document): Documento PDF de soportes
+        i (int): Índice del registro y de la página de TB correspondiente
+        soporte_page_num (int): Página del PDF de soportes
+        region (tuple): Coordenadas (x0, y0, x1, y1) del soporte en la página
+    """
+    clip = fitz.Rect(region)
+
+    # Agregar la TB directamente desde el PDF original
+    target_doc.insert_pdf(tb_doc, from_page=i, to_page=i)
+
+    # Recortar la región del soporte directamente en una página nueva
+    page = target_doc.new_page(width=clip.width, height=clip.height)
+    page.show_pdf_page(page.rect, soporte_doc, soporte_page_num, clip=clip)
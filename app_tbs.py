@@ -1,24 +1,129 @@
 import sys
 import os
+import re
 import pandas as pd
 import fitz  # PyMuPDF
-import traceback
+import openpyxl
+import logging
+import hashlib
+import html
+import tempfile
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, 
                            QVBoxLayout, QHBoxLayout, QFileDialog, QProgressBar, 
-                           QWidget, QMessageBox, QTextEdit, QGroupBox, QGridLayout)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+                           QWidget, QMessageBox, QTextEdit, QGroupBox, QGridLayout,
+                           QCheckBox)
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, Qt
 from PyQt5.QtGui import QFont, QIcon, QColor
+from _pdf_worker import PDF_SAVE_OPTIONS, append_record, emit_one
 
-class PDFProcessor(QThread):
-    """
-    Clase worker que maneja el procesamiento de PDFs en un hilo separado
-    para evitar que la interfaz gráfica se congele durante operaciones largas.
-    """
+# Motor "calamine" de pandas (python-calamine); sin él se usa openpyxl en modo
+# read_only para .xlsx, o el motor por defecto para .xls
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# Carpeta donde se guardan los Excel ya procesados (clave: hash del contenido)
+EXCEL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gestor_tbs")
+
+# Franjas verticales (inicio, fin) de cada soporte dentro de una página, como
+# fracción de su altura. En lugar de dividir en tercios exactos, las regiones se
+# superponen ligeramente para no cortar información en los bordes:
+#   - superior: un poco más grande
+#   - media: superpuesta con la primera y la tercera
+#   - inferior: empieza más arriba para capturar el encabezado completo
+SOPORTE_H_FRACS = ((0.0, 0.34), (0.32, 0.68), (0.64, 1.0))
+
+# Caracteres no válidos en nombres de archivo (se conserva \w, espacio, punto y guion)
+_SAFE_RE = re.compile(r"[^\w .\-]+")
+
+# Intervalo (ms) con el que se agrupan los mensajes del registro en la interfaz
+LOG_FLUSH_INTERVAL_MS = 50
+
+# Tareas en vuelo por proceso worker al generar los PDFs combinados
+MAX_PENDING_PER_WORKER = 4
+
+# PyMuPDF no admite varios hilos: todo uso de fitz en los hilos de los trabajos
+# pasa por este candado (la generación de cada registro va en procesos aparte)
+FITZ_LOCK = threading.Lock()
+
+# Pool de procesos compartido por los trabajos en curso, con un proceso por CPU
+# para no sobresuscribirla cuando hay varios trabajos a la vez. Se usa "spawn"
+# porque hacer fork con otros hilos dentro de MuPDF puede bloquear los workers.
+# El último trabajo en soltarlo lo cierra: los workers mantienen abiertos los PDFs
+# de origen y en Windows eso impediría mover o borrar esos archivos
+_process_pool = None
+_process_pool_users = {}  # pool -> número de trabajos que lo están usando
+_process_pool_lock = threading.Lock()
+
+def acquire_process_pool():
+    """Devuelve el pool de procesos compartido, creándolo si no hay ninguno activo"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        _process_pool_users[_process_pool] = _process_pool_users.get(_process_pool, 0) + 1
+        return _process_pool
+        
+def release_process_pool(pool):
+    """Suelta el pool obtenido con acquire_process_pool; lo cierra si nadie más lo usa"""
+    global _process_pool
+    with _process_pool_lock:
+        users = _process_pool_users.pop(pool, 1) - 1
+        if users:
+            _process_pool_users[pool] = users
+        elif _process_pool is pool:
+            _process_pool = None
+    if not users:
+        pool.shutdown(wait=True)
+        
+def discard_process_pool(pool):
+    """Descarta el pool si un worker murió, para que el próximo trabajo cree otro"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is pool:
+            _process_pool = None
+    pool.shutdown(wait=False)
+    
+def shutdown_process_pool():
+    """Cierra el pool de procesos compartido al salir de la aplicación"""
+    global _process_pool
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+def _cell_text(value):
+    """Convierte el valor de una celda a texto como lo hace pandas con dtype=str"""
+    if value is None:
+        return float("nan")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+class PDFProcessorSignals(QObject):
+    """Señales de PDFProcessor (un QRunnable no puede emitir señales propias)"""
     progress_update = pyqtSignal(int)
     log_update = pyqtSignal(str)
     finished_signal = pyqtSignal(bool, str)
 
-    def __init__(self, tb_path, soporte_path, excel_path, output_folder):
+class PDFProcessor(QRunnable):
+    """
+    Trabajo que maneja el procesamiento de PDFs en un hilo del QThreadPool
+    para evitar que la interfaz gráfica se congele durante operaciones largas.
+    Cada trabajo es independiente, por lo que varios pueden ejecutarse a la vez.
+    """
+
+    def __init__(self, tb_path, soporte_path, excel_path, output_folder, use_cache=True,
+                 single_output=False):
         """
         Inicializa el procesador de PDFs.
         
@@ -27,19 +132,43 @@ class PDFProcessor(QThread):
             soporte_path (str): Ruta al archivo PDF de soportes
             excel_path (str): Ruta al archivo Excel
             output_folder (str): Carpeta de salida para los PDFs generados
+            use_cache (bool): Reutilizar el Excel ya leído si su contenido no cambió
+            single_output (bool): Generar un solo PDF con un marcador por registro
         """
         super().__init__()
+        # La ventana conserva la referencia al trabajo hasta que termina
+        self.setAutoDelete(False)
+        
+        self.signals = PDFProcessorSignals()
+        self.progress_update = self.signals.progress_update
+        self.log_update = self.signals.log_update
+        self.finished_signal = self.signals.finished_signal
+        
         self.tb_path = tb_path
         self.soporte_path = soporte_path
         self.excel_path = excel_path
         self.output_folder = output_folder
+        self.use_cache = use_cache
+        self.single_output = single_output
+        
+        # Registros que no se pudieron generar en la última ejecución
+        self.failed_records = 0
+        
+        # Último porcentaje emitido, para no repetir señales
+        self._last_pct = -1
         
     def log(self, message):
         """Emite un mensaje para el registro de la aplicación"""
         self.log_update.emit(message)
         
+    def set_progress(self, progress):
+        """Emite el progreso solo cuando cambia el porcentaje"""
+        if progress != self._last_pct:
+            self.progress_update.emit(progress)
+            self._last_pct = progress
+        
     def run(self):
-        """Método principal que se ejecuta cuando se inicia el hilo"""
+        """Método principal que se ejecuta cuando el pool inicia el trabajo"""
         try:
             self.log("Iniciando procesamiento...")
             
@@ -50,32 +179,45 @@ class PDFProcessor(QThread):
                 self.finished_signal.emit(False, "Error al leer el archivo Excel")
                 return
                 
-            # 2. Procesar PDF de TBs
-            self.log("Extrayendo TBs del PDF...")
-            tb_pages = self.extract_tb_pages()
-            if tb_pages is None:
+            # 2. Abrir PDF de TBs (se mantiene abierto durante todo el proceso)
+            self.log("Abriendo PDF de TBs...")
+            tb_doc = self.open_tb_document()
+            if tb_doc is None:
                 self.finished_signal.emit(False, "Error al procesar el PDF de TBs")
                 return
                 
-            # 3. Procesar PDF de soportes
-            self.log("Extrayendo soportes de pago del PDF...")
-            soporte_regions = self.extract_soporte_regions()
-            if soporte_regions is None:
-                self.finished_signal.emit(False, "Error al procesar el PDF de soportes")
-                return
+            try:
+                # 3. Procesar PDF de soportes
+                self.log("Extrayendo soportes de pago del PDF...")
+                soporte_regions = self.extract_soporte_regions()
+                if soporte_regions is None:
+                    self.finished_signal.emit(False, "Error al procesar el PDF de soportes")
+                    return
+                    
+                # 4. Crear archivos PDF combinados
+                self.log("Generando archivos PDF individuales...")
+                success = self.create_combined_pdfs(df, tb_doc, soporte_regions)
+                if not success:
+                    self.finished_signal.emit(False, "Error al generar archivos PDF")
+                    return
+            finally:
+                with FITZ_LOCK:
+                    tb_doc.close()
                 
-            # 4. Crear archivos PDF combinados
-            self.log("Generando archivos PDF individuales...")
-            success = self.create_combined_pdfs(df, tb_pages, soporte_regions)
-            if not success:
-                self.finished_signal.emit(False, "Error al generar archivos PDF")
+            if self.failed_records:
+                self.log("Procesamiento completado con errores")
+                self.finished_signal.emit(True, f"Se generaron los archivos PDF en: {self.output_folder}, "
+                                                f"pero no se pudieron generar {self.failed_records} registros "
+                                                "(ver el registro)")
                 return
                 
             self.log("Procesamiento completado con éxito!")
             self.finished_signal.emit(True, f"Se han generado correctamente los archivos PDF en: {self.output_folder}")
             
         except Exception as e:
-            error_msg = f"Error durante el procesamiento: {str(e)}\n{traceback.format_exc()}"
+            # El traceback completo solo va al log de Python, no a la interfaz
+            logger.exception("Error durante el procesamiento")
+            error_msg = f"Error durante el procesamiento: {str(e)}"
             self.log(error_msg)
             self.finished_signal.emit(False, error_msg)
     
@@ -88,10 +230,16 @@ class PDFProcessor(QThread):
         """
         try:
             # Leer archivo Excel con las columnas "No Egreso" y "Girado a"
-            df = pd.read_excel(self.excel_path)
+            # Solo se cargan las columnas requeridas y como texto, ya que
+            # ambas se usan como cadenas para el nombre de archivo
+            required_columns = ["No Egreso", "Girado a"]
+            cache_path = self.excel_cache_path(required_columns) if self.use_cache else None
+            df = self.read_excel_cache(cache_path)
+            if df is None:
+                df = self.read_excel_columns(required_columns, text_columns=required_columns)
+                self.write_excel_cache(df, cache_path)
             
             # Verificar que las columnas requeridas existan
-            required_columns = ["No Egreso", "Girado a"]
             for col in required_columns:
                 if col not in df.columns:
                     self.log(f"Error: Columna '{col}' no encontrada en el archivo Excel")
@@ -104,37 +252,170 @@ class PDFProcessor(QThread):
             self.log(f"Error al leer el archivo Excel: {str(e)}")
             return None
             
-    def extract_tb_pages(self):
+    def read_excel_columns(self, columns, text_columns):
+        """
+        Lee del Excel solo las columnas indicadas
+        
+        Args:
+            columns (list): Columnas a leer; las que no existan se omiten
+            text_columns (list): Columnas que se leen como texto
+            
+        Returns:
+            pandas.DataFrame: DataFrame con las columnas encontradas
+        """
+        reader = self.excel_reader()
+        if reader == "openpyxl-read_only":
+            return self.read_excel_streaming(columns, text_columns)
+            
+        return pd.read_excel(self.excel_path, engine="calamine" if reader == "calamine" else None,
+                             usecols=lambda col: col in columns,
+                             dtype={col: str for col in text_columns})
+        
+    def excel_reader(self):
+        """
+        Elige cómo leer el Excel según los motores disponibles y su extensión
+        
+        Returns:
+            str: "calamine", "pandas" (motor por defecto, para .xls) u "openpyxl-read_only"
+        """
+        if CALAMINE_AVAILABLE:
+            return "calamine"
+        if os.path.splitext(self.excel_path)[1].lower() == ".xls":
+            return "pandas"
+        return "openpyxl-read_only"
+        
+    def read_excel_streaming(self, columns, text_columns):
         """
-        Extrae cada página del PDF de TBs como un documento PDF separado
+        Lee las columnas indicadas recorriendo la primera hoja fila a fila con
+        openpyxl en modo read_only, sin cargar el libro completo en memoria
         
+        Args:
+            columns (list): Columnas a leer; las que no existan se omiten
+            text_columns (list): Columnas que se leen como texto
+            
         Returns:
-            list: Lista de objetos DocumentPage o None si hay error
+            pandas.DataFrame: DataFrame con las columnas encontradas
         """
+        wb = openpyxl.load_workbook(self.excel_path, read_only=True, data_only=True)
         try:
-            # Abrir el PDF de TBs
-            doc = fitz.open(self.tb_path)
-            
-            # Lista para almacenar cada página de TB
-            tb_pages = []
-            
-            # Extraer cada página como un documento separado
-            total_pages = len(doc)
-            for i in range(total_pages):
-                # Crear un nuevo documento con esta página
-                new_doc = fitz.open()
-                new_doc.insert_pdf(doc, from_page=i, to_page=i)
-                tb_pages.append(new_doc)
-                
-                # Actualizar progreso
-                progress = int((i + 1) / total_pages * 33)  # Primer tercio del proceso
-                self.progress_update.emit(progress)
+            # En modo read_only iter_rows se fía de la dimensión guardada en la
+            # hoja, que algunos programas escriben mal (p. ej. "A1"); pandas
+            # también la descarta antes de leer
+            ws = wb.worksheets[0]
+            ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            
+            # Posición de cada columna buscada según el encabezado
+            positions = {}
+            for idx, name in enumerate(next(rows, ())):
+                if name in columns and name not in positions:
+                    positions[name] = idx
+                    
+            data = {name: [] for name in positions}
+            num_rows = 0
+            last_filled = 0
+            for row in rows:
+                values = [row[idx] if idx < len(row) else None for idx in positions.values()]
+                for name, value in zip(positions, values):
+                    data[name].append(_cell_text(value) if name in text_columns else value)
+                num_rows += 1
                 
-            self.log(f"Se extrajeron {len(tb_pages)} TBs del PDF")
-            return tb_pages
+                # Como pandas, una fila solo cuenta como vacía si lo está en todas
+                # sus columnas, no solo en las leídas
+                if any(value is not None and value != "" for value in row):
+                    last_filled = num_rows
+        finally:
+            wb.close()
+            
+        # Descartar las filas vacías del final, como hace pandas
+        return pd.DataFrame({name: values[:last_filled] for name, values in data.items()})
+        
+    def excel_cache_path(self, columns):
+        """
+        Calcula la ruta en caché del Excel a partir del hash de su contenido
+        
+        Args:
+            columns (list): Columnas leídas del Excel (forman parte de la clave)
+            
+        Returns:
+            str: Ruta del archivo parquet en caché
+        """
+        # La clave incluye el lector usado, por si sus resultados difieren
+        h = hashlib.blake2b(digest_size=16)
+        h.update("|".join([self.excel_reader()] + columns).encode("utf-8"))
+        with open(self.excel_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return os.path.join(EXCEL_CACHE_DIR, f"{h.hexdigest()}.parquet")
+        
+    def read_excel_cache(self, cache_path):
+        """
+        Carga el Excel desde la caché si existe
+        
+        Args:
+            cache_path (str): Ruta del archivo en caché, o None si no se usa caché
+            
+        Returns:
+            pandas.DataFrame: DataFrame en caché, o None si no está disponible
+        """
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        try:
+            df = pd.read_parquet(cache_path)
+            
+            # Parquet devuelve las celdas vacías de texto como None; se restaura
+            # NaN para que el resultado sea igual al de una lectura nueva
+            df = df.mask(df.isna())
+            self.log("Excel cargado desde la caché")
+            return df
+        except Exception as e:
+            self.log(f"Advertencia: No se pudo leer la caché del Excel: {str(e)}")
+            return None
+            
+    def write_excel_cache(self, df, cache_path):
+        """
+        Guarda el Excel leído en la caché; un fallo no detiene el proceso
+        
+        Args:
+            df (pandas.DataFrame): DataFrame leído del Excel
+            cache_path (str): Ruta del archivo en caché, o None si no se usa caché
+        """
+        if cache_path is None:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(EXCEL_CACHE_DIR, exist_ok=True)
+            
+            # Escribir en un archivo temporal y reemplazar al final, para no dejar
+            # nunca una entrada a medio escribir en la caché
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=EXCEL_CACHE_DIR)
+            os.close(fd)
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            self.log(f"Advertencia: No se pudo guardar la caché del Excel: {str(e)}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            
+    def open_tb_document(self):
+        """
+        Abre el PDF de TBs; cada página corresponde a una TB
+        
+        Returns:
+            fitz.Document: Documento PDF de TBs, o None si hay error
+        """
+        try:
+            with FITZ_LOCK:
+                doc = fitz.open(self.tb_path)
+                tb_pages = len(doc)
+            self.log(f"Se encontraron {tb_pages} TBs en el PDF")
+            
+            # Primer tercio del proceso
+            self.set_progress(33)
+            return doc
             
         except Exception as e:
-            self.log(f"Error al extraer TBs: {str(e)}")
+            self.log(f"Error al abrir el PDF de TBs: {str(e)}")
             return None
     
     def extract_soporte_regions(self):
@@ -145,36 +426,24 @@ class PDFProcessor(QThread):
             list: Lista de tuplas (página, región) para cada soporte, o None si hay error
         """
         try:
-            # Abrir el PDF de soportes
-            doc = fitz.open(self.soporte_path)
+            # Abrir el PDF de soportes (se cierra al terminar de leer las páginas)
+            with FITZ_LOCK, fitz.open(self.soporte_path) as doc:
+                # Ajustamos el algoritmo para tener regiones que se superpongan ligeramente
+                soporte_regions = []
+                total_pages = len(doc)
             
-            # Ajustamos el algoritmo para tener regiones que se superpongan ligeramente
-            soporte_regions = []
-            total_pages = len(doc)
-            
-            for page_num in range(total_pages):
-                page = doc[page_num]
-                page_height = page.rect.height
-                page_width = page.rect.width
-                
-                # En lugar de dividir en tercios exactos, creamos regiones con superposición
-                # Esto ayudará a evitar cortar información en los bordes
-                
-                # Primera región (superior) - un poco más grande
-                r1 = fitz.Rect(0, 0, page_width, page_height * 0.34)
-                soporte_regions.append((page_num, r1))
+                for page_num in range(total_pages):
+                    rect = doc[page_num].rect
+                    w, h = rect.width, rect.height
                 
-                # Segunda región (medio) - superposición con primera y tercera
-                r2 = fitz.Rect(0, page_height * 0.32, page_width, page_height * 0.68)
-                soporte_regions.append((page_num, r2))
+                    # Una región por cada franja de SOPORTE_H_FRACS
+                    soporte_regions.extend([
+                        (page_num, fitz.Rect(0, h * top, w, h * bottom)) for top, bottom in SOPORTE_H_FRACS
+                    ])
                 
-                # Tercera región (inferior) - empieza más arriba para capturar el encabezado completo
-                r3 = fitz.Rect(0, page_height * 0.64, page_width, page_height)
-                soporte_regions.append((page_num, r3))
-                
-                # Actualizar progreso
-                progress = 33 + int((page_num + 1) / total_pages * 33)  # Segundo tercio del proceso
-                self.progress_update.emit(progress)
+                    # Actualizar progreso
+                    progress = 33 + int((page_num + 1) / total_pages * 33)  # Segundo tercio del proceso
+                    self.set_progress(progress)
                 
             self.log(f"Se detectaron {len(soporte_regions)} posibles regiones de soportes")
             return soporte_regions
@@ -183,13 +452,13 @@ class PDFProcessor(QThread):
             self.log(f"Error al extraer regiones de soportes: {str(e)}")
             return None
             
-    def create_combined_pdfs(self, df, tb_pages, soporte_regions):
+    def create_combined_pdfs(self, df, tb_doc, soporte_regions):
         """
         Crea archivos PDF combinados con TB y soporte correspondiente
         
         Args:
             df (pandas.DataFrame): DataFrame con información de TBs
-            tb_pages (list): Lista de documentos PDF con páginas de TBs
+            tb_doc (fitz.Document): Documento PDF de TBs (una TB por página)
             soporte_regions (list): Lista de regiones de soportes
             
         Returns:
@@ -199,82 +468,199 @@ class PDFProcessor(QThread):
             # Asegurarse de que la carpeta de salida exista
             os.makedirs(self.output_folder, exist_ok=True)
             
-            # Por cada registro en el Excel
-            total_records = len(df)
-            for i, row in df.iterrows():
-                # Obtener valores de las columnas
-                num_egreso = str(row["No Egreso"])
-                girado_a = str(row["Girado a"])
-                
+            # Obtener valores de las columnas de una sola vez
+            # Limpiar "Girado a" para eliminar caracteres no válidos en nombres de archivo
+            num_egresos = df["No Egreso"].astype(str).tolist()
+            safe_girados = (df["Girado a"].astype(str)
+                            .str.replace(_SAFE_RE, "", regex=True)
+                            .str.strip()
+                            .tolist())
+            
+            # Preparar una tarea por cada registro del Excel
+            with FITZ_LOCK:
+                tb_pages = len(tb_doc)
+            self.failed_records = 0
+            tasks = []
+            for i in range(len(num_egresos)):
                 # Verificar que tenemos suficientes TBs y soportes
-                if i >= len(tb_pages) or i >= len(soporte_regions):
+                if i >= tb_pages or i >= len(soporte_regions):
                     self.log(f"Advertencia: No hay suficientes TBs o soportes para el registro {i+1}")
                     continue
                     
-                # Obtener TB correspondiente
-                tb_doc = tb_pages[i]
-                
                 # Obtener soporte correspondiente
                 soporte_page_num, region = soporte_regions[i]
                 
-                # Abrir el PDF de soportes
-                soporte_doc = fitz.open(self.soporte_path)
-                soporte_page = soporte_doc[soporte_page_num]
-                
-                # Crear un nuevo documento para el soporte recortado
-                cropped_soporte = fitz.open()
-                new_page = cropped_soporte.new_page(width=region.width, height=region.height)
+                tasks.append((self.tb_path, self.soporte_path, i, num_egresos[i], safe_girados[i],
+                              soporte_page_num, tuple(region), self.output_folder))
                 
-                # Recortar y copiar la región del soporte
-                new_page.show_pdf_page(new_page.rect, soporte_doc, soporte_page_num, clip=region)
+            if tasks and self.single_output:
+                if not self.write_merged_pdf(tasks, tb_doc):
+                    return False
+            elif tasks:
+                tasks = self.dedupe_output_names(tasks)
                 
-                # Crear el documento final combinado
-                final_doc = fitz.open()
+                # Cada registro es independiente: se reparten entre los procesos
+                # del pool compartido. PyMuPDF no admite varios hilos, por eso se
+                # usan procesos.
+                executor = acquire_process_pool()
+                max_pending = (os.cpu_count() or 1) * MAX_PENDING_PER_WORKER
                 
-                # Agregar la TB
-                final_doc.insert_pdf(tb_doc)
-                
-                # Agregar el soporte recortado
-                final_doc.insert_pdf(cropped_soporte)
-                
-                # Crear nombre de archivo usando No Egreso y Girado a
-                # Limpiar el nombre para eliminar caracteres no válidos
-                safe_girado_a = "".join(c for c in girado_a if c.isalnum() or c in " ._-").strip()
-                filename = f"{num_egreso} - {safe_girado_a}.pdf"
-                output_path = os.path.join(self.output_folder, filename)
-                
-                # Guardar el documento final
-                final_doc.save(output_path)
-                final_doc.close()
-                
-                # Cerrar documentos
-                cropped_soporte.close()
-                
-                # Actualizar progreso - Ajustamos para asegurar que llegue a 100%
-                progress = 66 + int((i + 1) / total_records * 34)
-                self.progress_update.emit(progress)
-                self.log(f"Generado archivo: {filename}")
-                
-            soporte_doc.close()
-            
-            # Cerrar todos los documentos TB
-            for doc in tb_pages:
-                doc.close()
+                try:
+                    completed = 0
+                    pending = {}  # tarea en vuelo -> índice del registro
+                    for task in tasks:
+                        pending[executor.submit(emit_one, *task)] = task[2]
+                        
+                        # Limitar las tareas en vuelo para no acumular memoria
+                        if len(pending) >= max_pending:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            completed = self._report_completed(done, pending, completed, len(tasks))
+                            
+                    for future in as_completed(list(pending)):
+                        completed = self._report_completed([future], pending, completed, len(tasks))
+                except BrokenProcessPool:
+                    # Un worker murió: el pool ya no sirve para este ni otros trabajos
+                    discard_process_pool(executor)
+                    raise
+                finally:
+                    release_process_pool(executor)
+                        
+            if self.failed_records:
+                self.log(f"Advertencia: No se pudieron generar {self.failed_records} registros")
                 
             # Asegurar que el progreso llegue al 100% al finalizar
-            self.progress_update.emit(100)
+            self.set_progress(100)
             
             return True
             
         except Exception as e:
             self.log(f"Error al crear PDFs combinados: {str(e)}")
             return False
+            
+    def dedupe_output_names(self, tasks):
+        """
+        Deja una sola tarea por nombre de archivo. En paralelo, dos registros con
+        el mismo nombre se guardarían a la vez; se conserva el último, como
+        cuando se generaban en orden
+        
+        Args:
+            tasks (list): Tareas de los registros, como las recibe emit_one
+            
+        Returns:
+            list: Tareas sin nombres de archivo repetidos
+        """
+        by_name = {}  # nombre normalizado -> tarea
+        for task in tasks:
+            filename = f"{task[3]} - {task[4]}.pdf"
+            key = os.path.normcase(filename)
+            previous = by_name.pop(key, None)
+            if previous is not None:
+                self.log(f"Advertencia: Los registros {previous[2]+1} y {task[2]+1} generan el mismo "
+                         f"archivo '{filename}'; se conserva el registro {task[2]+1}")
+            by_name[key] = task
+        return list(by_name.values())
+        
+    def write_merged_pdf(self, tasks, tb_doc):
+        """
+        Genera un único PDF con todos los registros y un marcador por cada uno
+        
+        Args:
+            tasks (list): Tareas de los registros, como las recibe emit_one
+            tb_doc (fitz.Document): Documento PDF de TBs (una TB por página)
+            
+        Returns:
+            bool: True si se generó el archivo, False si no quedó ningún registro
+        """
+        toc = []
+        with FITZ_LOCK, fitz.open() as merged, fitz.open(self.soporte_path) as soporte_doc:
+            for completed, (_, _, i, num_egreso, safe_girado, soporte_page_num, region, _) in enumerate(tasks, 1):
+                start_page = merged.page_count
+                try:
+                    append_record(merged, tb_doc, soporte_doc, i, soporte_page_num, region)
+                    toc.append([1, f"{num_egreso} - {safe_girado}", start_page + 1])
+                except Exception as e:
+                    # Descartar las páginas que alcanzaron a agregarse
+                    if merged.page_count > start_page:
+                        merged.delete_pages(from_page=start_page, to_page=merged.page_count - 1)
+                    self.failed_records += 1
+                    self.log(f"Error en el registro {i+1}: {e!r}")
+                    
+                # Actualizar progreso - Ajustamos para asegurar que llegue a 100%
+                self.set_progress(66 + int(completed / len(tasks) * 34))
+                
+            if merged.page_count == 0:
+                self.log("Error: No se pudo generar ningún registro del PDF único")
+                return False
+            output_path = self.merged_output_path()
+            merged.set_toc(toc)
+            merged.save(output_path, **PDF_SAVE_OPTIONS)
+            
+        self.log(f"Generado archivo: {os.path.basename(output_path)} ({len(toc)} registros)")
+        return True
+        
+    def merged_output_path(self):
+        """
+        Ruta del PDF único, nombrado como el Excel de origen. Nunca reemplaza un
+        archivo existente: agrega " (2)", " (3)", ... al nombre si hace falta
+        
+        Returns:
+            str: Ruta libre en la carpeta de salida
+        """
+        stem = os.path.splitext(os.path.basename(self.excel_path))[0]
+        output_path = os.path.join(self.output_folder, f"{stem}.pdf")
+        copy = 2
+        while os.path.exists(output_path):
+            output_path = os.path.join(self.output_folder, f"{stem} ({copy}).pdf")
+            copy += 1
+        return output_path
+        
+    def _report_completed(self, futures, pending, completed, total):
+        """
+        Registra los archivos generados por tareas terminadas y actualiza el progreso.
+        Un registro que falla se informa y se omite sin detener el resto.
+        
+        Args:
+            futures (iterable): Tareas terminadas
+            pending (dict): Tareas en vuelo y su índice de registro; se retiran las terminadas
+            completed (int): Número de registros procesados hasta ahora
+            total (int): Número total de archivos a generar
+            
+        Returns:
+            int: Número de registros procesados tras registrar estas tareas
+        """
+        for future in futures:
+            i = pending.pop(future)
+            completed += 1
+            
+            # Actualizar progreso - Ajustamos para asegurar que llegue a 100%
+            progress = 66 + int(completed / total * 34)
+            self.set_progress(progress)
+            
+            try:
+                output_path = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                self.failed_records += 1
+                self.log(f"Error en el registro {i+1}: {e!r}")
+                continue
+                
+            self.log(f"Generado archivo: {os.path.basename(output_path)}")
+        return completed
 
 class MainWindow(QMainWindow):
     """Ventana principal de la aplicación"""
     
     def __init__(self):
         super().__init__()
+        # Entradas de registro pendientes de mostrar; se vuelcan juntas
+        # para no repintar el área de registro por cada mensaje
+        self._log_buffer = []
+        self._log_timer = QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self._log_timer.timeout.connect(self._flush_log)
+        
         self.init_ui()
         
         # Inicializar variables para almacenar rutas de archivos
@@ -283,8 +669,14 @@ class MainWindow(QMainWindow):
         self.excel_path = None
         self.output_folder = None
         
-        # Variable para almacenar el worker thread
-        self.worker = None
+        # Trabajos en curso (id -> PDFProcessor) y su último progreso
+        self.workers = {}
+        self.worker_progress = {}
+        self._next_job_id = 1
+        
+        # Los trabajos se ejecutan en paralelo en el pool global de hilos
+        self.thread_pool = QThreadPool.globalInstance()
+        self.thread_pool.setMaxThreadCount(os.cpu_count() or 1)
         
     def init_ui(self):
         """Inicializa la interfaz de usuario"""
@@ -451,6 +843,12 @@ class MainWindow(QMainWindow):
         button_container.addWidget(self.process_button)
         button_container.addStretch(1)
         
+        # Opción para forzar la lectura completa del Excel
+        self.no_cache_checkbox = QCheckBox("No usar caché del Excel")
+        
+        # Opción para generar un solo PDF con marcadores en lugar de uno por registro
+        self.single_output_checkbox = QCheckBox("Salida única con marcadores")
+        
         # Área de registro
         self.log_label = QLabel("Registro de actividad:")
         self.log_text = QTextEdit()
@@ -460,6 +858,8 @@ class MainWindow(QMainWindow):
         # Agregar al layout
         process_layout.addWidget(progress_label)
         process_layout.addWidget(self.progress_bar)
+        process_layout.addWidget(self.no_cache_checkbox)
+        process_layout.addWidget(self.single_output_checkbox)
         process_layout.addLayout(button_container)
         process_layout.addWidget(self.log_label)
         process_layout.addWidget(self.log_text)
@@ -477,25 +877,45 @@ class MainWindow(QMainWindow):
         
     def log(self, message):
         """Agrega un mensaje al área de registro"""
+        # El registro se inserta como HTML: escapar el texto y conservar los saltos de línea
+        message_html = html.escape(message).replace("\n", "<br>")
+        
         # Añadir formato de color según el tipo de mensaje
         if "Error" in message:
-            formatted_message = f"<span style='color:#e74c3c;'>{message}</span>"
+            formatted_message = f"<span style='color:#e74c3c;'>{message_html}</span>"
         elif "Advertencia" in message:
-            formatted_message = f"<span style='color:#f39c12;'>{message}</span>"
+            formatted_message = f"<span style='color:#f39c12;'>{message_html}</span>"
         elif "completado" in message.lower() or "éxito" in message.lower() or "generado" in message.lower():
-            formatted_message = f"<span style='color:#27ae60;'>{message}</span>"
+            formatted_message = f"<span style='color:#27ae60;'>{message_html}</span>"
         else:
-            formatted_message = message
+            formatted_message = message_html
             
         # Añadir timestamp
         from datetime import datetime
         timestamp = datetime.now().strftime("%H:%M:%S")
         entry = f"[{timestamp}] {formatted_message}"
         
-        self.log_text.append(entry)
-        # Desplazarse al final
+        self._log_buffer.append(entry)
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+            
+    def _flush_log(self):
+        """Vuelca al área de registro las entradas pendientes en una sola edición"""
+        self._log_timer.stop()
+        if not self._log_buffer:
+            return
+        entries, self._log_buffer = self._log_buffer, []
+        
+        # Insertar al final, un bloque por entrada: si todo fuera un solo bloque,
+        # Qt tendría que volver a maquetar el registro completo en cada volcado
         cursor = self.log_text.textCursor()
         cursor.movePosition(cursor.End)
+        cursor.beginEditBlock()
+        for entry in entries:
+            if not self.log_text.document().isEmpty():
+                cursor.insertBlock()
+            cursor.insertHtml(entry)
+        cursor.endEditBlock()
         self.log_text.setTextCursor(cursor)
         
     def check_files_selected(self):
@@ -568,73 +988,80 @@ class MainWindow(QMainWindow):
             self.check_files_selected()
             
     def process_files(self):
-        """Inicia el procesamiento de archivos"""
-        # Deshabilitar botón durante el proceso
-        self.process_button.setEnabled(False)
-        self.process_button.setStyleSheet("""
-            QPushButton {
-                background-color: #cccccc;
-                color: #666666;
-                font-size: 14px;
-            }
-        """)
-        
-        # Restablecer barra de progreso
-        self.progress_bar.setValue(0)
+        """Encola un trabajo con los archivos seleccionados"""
+        # Dos trabajos sobre la misma carpeta escribirían los mismos archivos a la vez
+        def folder_key(path):
+            return os.path.normcase(os.path.abspath(path))
+        if any(folder_key(w.output_folder) == folder_key(self.output_folder)
+               for w in self.workers.values()):
+            self.log("Advertencia: Ya hay un trabajo en curso con esa carpeta de salida")
+            QMessageBox.warning(self, "Carpeta en uso",
+                                "Ya hay un trabajo en curso que escribe en esa carpeta de salida. "
+                                "Espere a que termine o elija otra carpeta.")
+            return
+            
+        job_id = self._next_job_id
+        self._next_job_id += 1
         
-        # Crear worker thread
-        self.worker = PDFProcessor(
+        # Crear trabajo
+        worker = PDFProcessor(
             self.tb_path,
             self.soporte_path,
             self.excel_path,
-            self.output_folder
+            self.output_folder,
+            use_cache=not self.no_cache_checkbox.isChecked(),
+            single_output=self.single_output_checkbox.isChecked()
         )
+        self.workers[job_id] = worker
+        self.worker_progress[job_id] = 0
+        self.update_progress(job_id, 0)
         
         # Conectar señales
-        self.worker.progress_update.connect(self.update_progress)
-        self.worker.log_update.connect(self.log)
-        self.worker.finished_signal.connect(self.processing_finished)
+        worker.progress_update.connect(lambda value, job=job_id: self.update_progress(job, value))
+        worker.log_update.connect(lambda message, job=job_id: self.log(f"[#{job}] {message}"))
+        worker.finished_signal.connect(
+            lambda success, message, job=job_id: self.processing_finished(job, success, message))
         
-        # Iniciar procesamiento
-        self.log("Iniciando proceso...")
-        self.worker.start()
+        # Encolar procesamiento
+        self.log(f"[#{job_id}] Iniciando proceso...")
+        self.thread_pool.start(worker)
         
-    def update_progress(self, value):
-        """Actualiza la barra de progreso"""
-        self.progress_bar.setValue(value)
+    def update_progress(self, job_id, value):
+        """Actualiza la barra de progreso con el promedio de los trabajos en curso"""
+        self.worker_progress[job_id] = value
+        self.progress_bar.setValue(int(sum(self.worker_progress.values()) / len(self.worker_progress)))
         
-    def processing_finished(self, success, message):
-        """Maneja la finalización del procesamiento"""
-        # Asegurar que la barra de progreso esté al 100%
-        self.progress_bar.setValue(100)
+    def processing_finished(self, job_id, success, message):
+        """Maneja la finalización de un trabajo"""
+        # Mostrar el registro pendiente antes del mensaje final
+        self._flush_log()
         
-        # Habilitar botón nuevamente
-        self.process_button.setEnabled(True)
-        self.process_button.setStyleSheet("""
-            QPushButton {
-                background-color: #2ecc71;
-                font-size: 14px;
-            }
-            QPushButton:hover {
-                background-color: #27ae60;
-            }
-        """)
+        # Limpiar el trabajo terminado
+        self.workers.pop(job_id, None)
+        self.worker_progress.pop(job_id, None)
+        
+        # Asegurar que la barra de progreso esté al 100% si no quedan trabajos
+        if self.worker_progress:
+            self.progress_bar.setValue(int(sum(self.worker_progress.values()) / len(self.worker_progress)))
+        else:
+            self.progress_bar.setValue(100)
         
         # Mostrar mensaje de resultado
         if success:
-            QMessageBox.information(self, "Proceso Completado", message)
+            QMessageBox.information(self, "Proceso Completado", f"[#{job_id}] {message}")
         else:
-            QMessageBox.critical(self, "Error", message)
-            
-        # Limpiar worker
-        self.worker = None
+            QMessageBox.critical(self, "Error", f"[#{job_id}] {message}")
 
 def main():
     """Función principal de la aplicación"""
+    # Necesario para los procesos worker en ejecutables empaquetados (Windows)
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = MainWindow()
     window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    shutdown_process_pool()
+    sys.exit(exit_code)
 
 if __name__ == "__main__":
     main()
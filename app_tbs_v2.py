@@ -3,28 +3,144 @@ import os
 import re
 import pandas as pd
 import fitz  # PyMuPDF
-import traceback
+import openpyxl
+import logging
+import hashlib
+import queue
+import threading
+import html
+import tempfile
+import contextlib
 from datetime import datetime
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QLabel, 
                            QVBoxLayout, QHBoxLayout, QFileDialog, QProgressBar, 
-                           QWidget, QMessageBox, QTextEdit, QGroupBox, QGridLayout)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt
+                           QWidget, QMessageBox, QTextEdit, QGroupBox, QGridLayout,
+                           QCheckBox)
+from PyQt5.QtCore import QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, Qt
 from PyQt5.QtGui import QFont, QIcon
 from PIL import Image
 import pytesseract
 import io
 
+# Motor "calamine" de pandas (python-calamine); sin él se usa openpyxl en modo
+# read_only para .xlsx, o el motor por defecto para .xls
+try:
+    import python_calamine  # noqa: F401
+    CALAMINE_AVAILABLE = True
+except ImportError:
+    CALAMINE_AVAILABLE = False
 
-class PDFProcessor(QThread):
+logger = logging.getLogger(__name__)
+
+# Carpeta donde se guardan los Excel ya procesados (clave: hash del contenido)
+EXCEL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gestor_tbs")
+
+# Opciones de guardado de los PDFs generados: el documento se acaba de construir,
+# así que no hace falta recolectar basura ni reescribir los contenidos. Los
+# streams copiados de los PDFs de origen conservan su compresión; solo se
+# comprimen las fuentes que vengan sin comprimir (deflate=True comprimiría todos
+# los streams sin comprimir, imágenes incluidas, con el costo de CPU que implica)
+PDF_SAVE_OPTIONS = dict(garbage=0, deflate=False, deflate_images=False,
+                        deflate_fonts=True, clean=False)
+
+# Franjas verticales (inicio, fin) de cada soporte dentro de una página, como
+# fracción de su altura. En lugar de dividir en tercios exactos, las regiones se
+# superponen ligeramente para no cortar información en los bordes:
+#   - superior: un poco más grande
+#   - media: superpuesta con la primera y la tercera
+#   - inferior: empieza más arriba para capturar el encabezado completo
+SOPORTE_H_FRACS = ((0.0, 0.34), (0.32, 0.68), (0.64, 1.0))
+
+# PDFs generados que pueden esperar en memoria a ser escritos en disco
+WRITE_QUEUE_SIZE = 8
+
+# Caracteres no válidos en nombres de archivo (se conserva \w, espacio, punto y guion)
+_SAFE_RE = re.compile(r"[^\w .\-]+")
+
+# Intervalo (ms) con el que se agrupan los mensajes del registro en la interfaz
+LOG_FLUSH_INTERVAL_MS = 50
+
+
+class OutputWriter:
     """
-    Clase worker que maneja el procesamiento de PDFs en un hilo separado
-    para evitar que la interfaz gráfica se congele durante operaciones largas.
+    Hilo dedicado a escribir en disco los PDFs generados, para que el OCR y la
+    generación de los siguientes soportes no esperen a la escritura.
+    La cola es acotada: si el disco va más lento, quien escribe espera.
     """
+    
+    def __init__(self, on_written=None, maxsize=WRITE_QUEUE_SIZE):
+        """
+        Args:
+            on_written (callable): Se llama con la ruta de cada archivo ya escrito
+            maxsize (int): Archivos que pueden esperar en memoria
+        """
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.on_written = on_written
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        
+    def __enter__(self):
+        self.thread.start()
+        return self
+        
+    def __exit__(self, exc_type, exc, tb):
+        self.queue.put(None)
+        self.thread.join()
+        if exc_type is None and self.error is not None:
+            raise self.error
+        
+    def write(self, path, data):
+        """Encola un archivo para escribirlo en disco"""
+        if self.error is not None:
+            raise self.error
+        self.queue.put((path, data))
+        
+    def _run(self):
+        """Escribe los archivos encolados hasta recibir None"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            
+            # Tras un error se sigue vaciando la cola sin escribir
+            if self.error is not None:
+                continue
+            path, data = item
+            try:
+                with open(path, "wb") as f:
+                    f.write(data)
+            except Exception as e:
+                self.error = e
+                continue
+            if self.on_written is not None:
+                self.on_written(path)
+
+
+def _cell_text(value):
+    """Convierte el valor de una celda a texto como lo hace pandas con dtype=str"""
+    if value is None:
+        return float("nan")
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+class PDFProcessorSignals(QObject):
+    """Señales de PDFProcessor (un QRunnable no puede emitir señales propias)"""
     progress_update = pyqtSignal(int)
     log_update = pyqtSignal(str)
     finished_signal = pyqtSignal(bool, str)
 
-    def __init__(self, tb_path, soporte_path, excel_path, output_folder):
+
+class PDFProcessor(QRunnable):
+    """
+    Trabajo que maneja el procesamiento de PDFs en un hilo del QThreadPool
+    para evitar que la interfaz gráfica se congele durante operaciones largas.
+    Los trabajos se encolan y se ejecutan de uno en uno (PyMuPDF no admite varios hilos).
+    """
+
+    def __init__(self, tb_path, soporte_path, excel_path, output_folder, use_cache=True,
+                 single_output=False):
         """
         Inicializa el procesador de PDFs.
         
@@ -33,19 +149,43 @@ class PDFProcessor(QThread):
             soporte_path (str): Ruta al archivo PDF de soportes
             excel_path (str): Ruta al archivo Excel
             output_folder (str): Carpeta de salida para los PDFs generados
+            use_cache (bool): Reutilizar el Excel ya leído si su contenido no cambió
+            single_output (bool): Generar un solo PDF con un marcador por soporte emparejado
         """
         super().__init__()
+        # La ventana conserva la referencia al trabajo hasta que termina
+        self.setAutoDelete(False)
+        
+        self.signals = PDFProcessorSignals()
+        self.progress_update = self.signals.progress_update
+        self.log_update = self.signals.log_update
+        self.finished_signal = self.signals.finished_signal
+        
         self.tb_path = tb_path
         self.soporte_path = soporte_path
         self.excel_path = excel_path
         self.output_folder = output_folder
+        self.use_cache = use_cache
+        self.single_output = single_output
+        
+        # Soportes emparejados cuyo PDF no se pudo generar en la última ejecución
+        self.failed_records = 0
+        
+        # Último porcentaje emitido, para no repetir señales
+        self._last_pct = -1
         
     def log(self, message):
         """Emite un mensaje para el registro de la aplicación"""
         self.log_update.emit(message)
         
+    def set_progress(self, progress):
+        """Emite el progreso solo cuando cambia el porcentaje"""
+        if progress != self._last_pct:
+            self.progress_update.emit(progress)
+            self._last_pct = progress
+        
     def run(self):
-        """Método principal que se ejecuta cuando se inicia el hilo"""
+        """Método principal que se ejecuta cuando el pool inicia el trabajo"""
         try:
             self.log("Iniciando procesamiento...")
             
@@ -56,32 +196,44 @@ class PDFProcessor(QThread):
                 self.finished_signal.emit(False, "Error al leer el archivo Excel")
                 return
                 
-            # 2. Procesar PDF de TBs
-            self.log("Extrayendo TBs del PDF...")
-            tb_pages = self.extract_tb_pages()
-            if tb_pages is None:
+            # 2. Abrir PDF de TBs (se mantiene abierto durante todo el proceso)
+            self.log("Abriendo PDF de TBs...")
+            tb_doc = self.open_tb_document()
+            if tb_doc is None:
                 self.finished_signal.emit(False, "Error al procesar el PDF de TBs")
                 return
                 
-            # 3. Procesar PDF de soportes
-            self.log("Extrayendo soportes de pago del PDF...")
-            soporte_regions = self.extract_soporte_regions()
-            if soporte_regions is None:
-                self.finished_signal.emit(False, "Error al procesar el PDF de soportes")
-                return
+            try:
+                # 3. Procesar PDF de soportes
+                self.log("Extrayendo soportes de pago del PDF...")
+                soporte_regions = self.extract_soporte_regions()
+                if soporte_regions is None:
+                    self.finished_signal.emit(False, "Error al procesar el PDF de soportes")
+                    return
+                    
+                # 4. Crear archivos PDF combinados
+                self.log("Generando archivos PDF individuales...")
+                success = self.create_combined_pdfs(df, tb_doc, soporte_regions)
+                if not success:
+                    self.finished_signal.emit(False, "Error al generar archivos PDF")
+                    return
+            finally:
+                tb_doc.close()
                 
-            # 4. Crear archivos PDF combinados
-            self.log("Generando archivos PDF individuales...")
-            success = self.create_combined_pdfs(df, tb_pages, soporte_regions)
-            if not success:
-                self.finished_signal.emit(False, "Error al generar archivos PDF")
+            if self.failed_records:
+                self.log("Procesamiento completado con errores")
+                self.finished_signal.emit(True, f"Se generaron los archivos PDF en: {self.output_folder}, "
+                                                f"pero no se pudieron generar {self.failed_records} soportes "
+                                                "(ver el registro)")
                 return
                 
             self.log("Procesamiento completado con éxito!")
             self.finished_signal.emit(True, f"Se han generado correctamente los archivos PDF en: {self.output_folder}")
             
         except Exception as e:
-            error_msg = f"Error durante el procesamiento: {str(e)}\n{traceback.format_exc()}"
+            # El traceback completo solo va al log de Python, no a la interfaz
+            logger.exception("Error durante el procesamiento")
+            error_msg = f"Error durante el procesamiento: {str(e)}"
             self.log(error_msg)
             self.finished_signal.emit(False, error_msg)
     
@@ -94,10 +246,16 @@ class PDFProcessor(QThread):
         """
         try:
             # Leer archivo Excel con las columnas "No Egreso" y "Girado a"
-            df = pd.read_excel(self.excel_path)
+            # Solo se cargan las columnas usadas; las de texto sin inferir tipos
+            required_columns = ["No Egreso", "Girado a"]
+            used_columns = required_columns + ["Valor"]
+            cache_path = self.excel_cache_path(used_columns) if self.use_cache else None
+            df = self.read_excel_cache(cache_path)
+            if df is None:
+                df = self.read_excel_columns(used_columns, text_columns=required_columns)
+                self.write_excel_cache(df, cache_path)
             
             # Verificar que las columnas requeridas existan
-            required_columns = ["No Egreso", "Girado a"]
             for col in required_columns:
                 if col not in df.columns:
                     self.log(f"Error: Columna '{col}' no encontrada en el archivo Excel")
@@ -110,37 +268,168 @@ class PDFProcessor(QThread):
             self.log(f"Error al leer el archivo Excel: {str(e)}")
             return None
             
-    def extract_tb_pages(self):
+    def read_excel_columns(self, columns, text_columns):
         """
-        Extrae cada página del PDF de TBs como un documento PDF separado
+        Lee del Excel solo las columnas indicadas
         
+        Args:
+            columns (list): Columnas a leer; las que no existan se omiten
+            text_columns (list): Columnas que se leen como texto
+            
         Returns:
-            list: Lista de objetos DocumentPage o None si hay error
+            pandas.DataFrame: DataFrame con las columnas encontradas
         """
-        try:
-            # Abrir el PDF de TBs
-            doc = fitz.open(self.tb_path)
+        reader = self.excel_reader()
+        if reader == "openpyxl-read_only":
+            return self.read_excel_streaming(columns, text_columns)
             
-            # Lista para almacenar cada página de TB
-            tb_pages = []
+        return pd.read_excel(self.excel_path, engine="calamine" if reader == "calamine" else None,
+                             usecols=lambda col: col in columns,
+                             dtype={col: str for col in text_columns})
+        
+    def excel_reader(self):
+        """
+        Elige cómo leer el Excel según los motores disponibles y su extensión
+        
+        Returns:
+            str: "calamine", "pandas" (motor por defecto, para .xls) u "openpyxl-read_only"
+        """
+        if CALAMINE_AVAILABLE:
+            return "calamine"
+        if os.path.splitext(self.excel_path)[1].lower() == ".xls":
+            return "pandas"
+        return "openpyxl-read_only"
+        
+    def read_excel_streaming(self, columns, text_columns):
+        """
+        Lee las columnas indicadas recorriendo la primera hoja fila a fila con
+        openpyxl en modo read_only, sin cargar el libro completo en memoria
+        
+        Args:
+            columns (list): Columnas a leer; las que no existan se omiten
+            text_columns (list): Columnas que se leen como texto
             
-            # Extraer cada página como un documento separado
-            total_pages = len(doc)
-            for i in range(total_pages):
-                # Crear un nuevo documento con esta página
-                new_doc = fitz.open()
-                new_doc.insert_pdf(doc, from_page=i, to_page=i)
-                tb_pages.append(new_doc)
-                
-                # Actualizar progreso
-                progress = int((i + 1) / total_pages * 33)  # Primer tercio del proceso
-                self.progress_update.emit(progress)
+        Returns:
+            pandas.DataFrame: DataFrame con las columnas encontradas
+        """
+        wb = openpyxl.load_workbook(self.excel_path, read_only=True, data_only=True)
+        try:
+            # En modo read_only iter_rows se fía de la dimensión guardada en la
+            # hoja, que algunos programas escriben mal (p. ej. "A1"); pandas
+            # también la descarta antes de leer
+            ws = wb.worksheets[0]
+            ws.reset_dimensions()
+            rows = ws.iter_rows(values_only=True)
+            
+            # Posición de cada columna buscada según el encabezado
+            positions = {}
+            for idx, name in enumerate(next(rows, ())):
+                if name in columns and name not in positions:
+                    positions[name] = idx
+                    
+            data = {name: [] for name in positions}
+            num_rows = 0
+            last_filled = 0
+            for row in rows:
+                values = [row[idx] if idx < len(row) else None for idx in positions.values()]
+                for name, value in zip(positions, values):
+                    data[name].append(_cell_text(value) if name in text_columns else value)
+                num_rows += 1
                 
-            self.log(f"Se extrajeron {len(tb_pages)} TBs del PDF")
-            return tb_pages
+                # Como pandas, una fila solo cuenta como vacía si lo está en todas
+                # sus columnas, no solo en las leídas
+                if any(value is not None and value != "" for value in row):
+                    last_filled = num_rows
+        finally:
+            wb.close()
             
+        # Descartar las filas vacías del final, como hace pandas
+        return pd.DataFrame({name: values[:last_filled] for name, values in data.items()})
+        
+    def excel_cache_path(self, columns):
+        """
+        Calcula la ruta en caché del Excel a partir del hash de su contenido
+        
+        Args:
+            columns (list): Columnas leídas del Excel (forman parte de la clave)
+            
+        Returns:
+            str: Ruta del archivo parquet en caché
+        """
+        # La clave incluye el lector usado, por si sus resultados difieren
+        h = hashlib.blake2b(digest_size=16)
+        h.update("|".join([self.excel_reader()] + columns).encode("utf-8"))
+        with open(self.excel_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        return os.path.join(EXCEL_CACHE_DIR, f"{h.hexdigest()}.parquet")
+        
+    def read_excel_cache(self, cache_path):
+        """
+        Carga el Excel desde la caché si existe
+        
+        Args:
+            cache_path (str): Ruta del archivo en caché, o None si no se usa caché
+            
+        Returns:
+            pandas.DataFrame: DataFrame en caché, o None si no está disponible
+        """
+        if cache_path is None or not os.path.exists(cache_path):
+            return None
+        try:
+            df = pd.read_parquet(cache_path)
+            
+            # Parquet devuelve las celdas vacías de texto como None; se restaura
+            # NaN para que el resultado sea igual al de una lectura nueva
+            df = df.mask(df.isna())
+            self.log("Excel cargado desde la caché")
+            return df
         except Exception as e:
-            self.log(f"Error al extraer TBs: {str(e)}")
+            self.log(f"Advertencia: No se pudo leer la caché del Excel: {str(e)}")
+            return None
+            
+    def write_excel_cache(self, df, cache_path):
+        """
+        Guarda el Excel leído en la caché; un fallo no detiene el proceso
+        
+        Args:
+            df (pandas.DataFrame): DataFrame leído del Excel
+            cache_path (str): Ruta del archivo en caché, o None si no se usa caché
+        """
+        if cache_path is None:
+            return
+        tmp_path = None
+        try:
+            os.makedirs(EXCEL_CACHE_DIR, exist_ok=True)
+            
+            # Escribir en un archivo temporal y reemplazar al final, para no dejar
+            # nunca una entrada a medio escribir en la caché
+            fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=EXCEL_CACHE_DIR)
+            os.close(fd)
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            self.log(f"Advertencia: No se pudo guardar la caché del Excel: {str(e)}")
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            
+    def open_tb_document(self):
+        """
+        Abre el PDF de TBs; cada página corresponde a una TB
+        
+        Returns:
+            fitz.Document: Documento PDF de TBs, o None si hay error
+        """
+        try:
+            doc = fitz.open(self.tb_path)
+            self.log(f"Se encontraron {len(doc)} TBs en el PDF")
+            
+            # Primer tercio del proceso
+            self.set_progress(33)
+            return doc
+            
+        except Exception as e:
+            self.log(f"Error al abrir el PDF de TBs: {str(e)}")
             return None
     
     def extract_soporte_regions(self):
@@ -151,36 +440,24 @@ class PDFProcessor(QThread):
             list: Lista de tuplas (página, región) para cada soporte, o None si hay error
         """
         try:
-            # Abrir el PDF de soportes
-            doc = fitz.open(self.soporte_path)
-            
-            # Ajustamos el algoritmo para tener regiones que se superpongan ligeramente
-            soporte_regions = []
-            total_pages = len(doc)
+            # Abrir el PDF de soportes (se cierra al terminar de leer las páginas)
+            with fitz.open(self.soporte_path) as doc:
+                # Ajustamos el algoritmo para tener regiones que se superpongan ligeramente
+                soporte_regions = []
+                total_pages = len(doc)
             
-            for page_num in range(total_pages):
-                page = doc[page_num]
-                page_height = page.rect.height
-                page_width = page.rect.width
+                for page_num in range(total_pages):
+                    rect = doc[page_num].rect
+                    w, h = rect.width, rect.height
                 
-                # En lugar de dividir en tercios exactos, creamos regiones con superposición
-                # Esto ayudará a evitar cortar información en los bordes
+                    # Una región por cada franja de SOPORTE_H_FRACS
+                    soporte_regions.extend([
+                        (page_num, fitz.Rect(0, h * top, w, h * bottom)) for top, bottom in SOPORTE_H_FRACS
+                    ])
                 
-                # Primera región (superior) - un poco más grande
-                r1 = fitz.Rect(0, 0, page_width, page_height * 0.34)
-                soporte_regions.append((page_num, r1))
-                
-                # Segunda región (medio) - superposición con primera y tercera
-                r2 = fitz.Rect(0, page_height * 0.32, page_width, page_height * 0.68)
-                soporte_regions.append((page_num, r2))
-                
-                # Tercera región (inferior) - empieza más arriba para capturar el encabezado completo
-                r3 = fitz.Rect(0, page_height * 0.64, page_width, page_height)
-                soporte_regions.append((page_num, r3))
-                
-                # Actualizar progreso
-                progress = 33 + int((page_num + 1) / total_pages * 33)  # Segundo tercio del proceso
-                self.progress_update.emit(progress)
+                    # Actualizar progreso
+                    progress = 33 + int((page_num + 1) / total_pages * 33)  # Segundo tercio del proceso
+                    self.set_progress(progress)
                 
             self.log(f"Se detectaron {len(soporte_regions)} posibles regiones de soportes")
             return soporte_regions
@@ -208,13 +485,13 @@ class PDFProcessor(QThread):
         except ValueError:
             return None
             
-    def create_combined_pdfs(self, df, tb_pages, soporte_regions):
+    def create_combined_pdfs(self, df, tb_doc, soporte_regions):
         """
         Crea archivos PDF combinando TBs con sus correspondientes soportes de pago
         
         Args:
             df (pandas.DataFrame): DataFrame con la información de los egresos
-            tb_pages (list): Lista de documentos PDF de TBs
+            tb_doc (fitz.Document): Documento PDF de TBs (una TB por página)
             soporte_regions (list): Lista de regiones de soportes
             
         Returns:
@@ -222,76 +499,157 @@ class PDFProcessor(QThread):
         """
         try:
             os.makedirs(self.output_folder, exist_ok=True)
-            df["Emparejado"] = False
+            self.failed_records = 0
+            
+            # Valor de cada registro (0 si falta o no es numérico) y si ya está
+            # emparejado, para no recorrer el DataFrame fila por fila con cada soporte
+            if "Valor" in df.columns:
+                valores = pd.to_numeric(df["Valor"], errors="coerce").fillna(0).astype("int64").tolist()
+            else:
+                valores = [0] * len(df)
+            emparejados = [False] * len(df)
+            records = df.index.tolist()
 
-            soporte_doc = fitz.open(self.soporte_path)
             total_soportes = len(soporte_regions)
+            tb_pages = len(tb_doc)
             
-            for idx, (soporte_page_num, region) in enumerate(soporte_regions):
-                page = soporte_doc[soporte_page_num]
-                cropped_soporte = fitz.open()
-                new_page = cropped_soporte.new_page(width=region.width, height=region.height)
-                new_page.show_pdf_page(new_page.rect, soporte_doc, soporte_page_num, clip=region)
-
-                # Extraer imagen del soporte y aplicar OCR
-                pix = new_page.get_pixmap(dpi=300)
-                img_bytes = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_bytes))
-                extracted_text = pytesseract.image_to_string(image, lang="spa").upper()
-
-                self.log(f"Texto extraído del soporte #{idx+1}:\n{extracted_text}")
-                if "ABONADO" not in extracted_text:
-                    self.log(f"Soporte #{idx+1} rechazado: no contiene 'ABONADO'")
-                    cropped_soporte.close()
-                    continue
-
-                valor_soporte = self.extract_valor(extracted_text)
-                if valor_soporte is None:
-                    self.log(f"Soporte #{idx+1} rechazado: valor no encontrado")
-                    cropped_soporte.close()
-                    continue
-
-                match_idx = None
-                for i, row in df.iterrows():
-                    if not row["Emparejado"]:
-                        valor_tb = int(row["Valor"]) if "Valor" in row and pd.notna(row["Valor"]) else 0
-                        if abs(valor_tb - valor_soporte) <= 100:
-                            match_idx = i
-                            break
-
-                if match_idx is None:
-                    self.log(f"Soporte #{idx+1} rechazado: sin TB coincidente para valor ${valor_soporte:,}")
-                    cropped_soporte.close()
-                    continue
-
-                df.at[match_idx, "Emparejado"] = True
-                tb_doc = tb_pages[match_idx]
-                num_egreso = str(df.at[match_idx, "No Egreso"])
-                girado_a = str(df.at[match_idx, "Girado a"])
-                safe_girado_a = "".join(c for c in girado_a if c.isalnum() or c in " ._-").strip()
-                filename = f"{num_egreso} - {safe_girado_a}.pdf"
-                output_path = os.path.join(self.output_folder, filename)
-
-                final_doc = fitz.open()
-                final_doc.insert_pdf(tb_doc)
-                final_doc.insert_pdf(cropped_soporte)
-                final_doc.save(output_path)
-                final_doc.close()
-                cropped_soporte.close()
-
-                self.progress_update.emit(66 + int((idx + 1) / total_soportes * 34))
-                self.log(f"Generado archivo: {filename}")
-
-            soporte_doc.close()
-            for doc in tb_pages:
-                doc.close()
-            self.progress_update.emit(100)
+            # Los PDFs se escriben en disco desde OutputWriter mientras se procesan
+            # los siguientes soportes; cada archivo se informa una vez escrito
+            def on_written(path):
+                self.log(f"Generado archivo: {os.path.basename(path)}")
+                
+            # Con salida única los registros se agregan a un solo documento, con
+            # un marcador por cada uno, en lugar de escribir un archivo por soporte
+            toc = []
+            with fitz.open(self.soporte_path) as soporte_doc, \
+                    OutputWriter(on_written=on_written) as writer, \
+                    (fitz.open() if self.single_output else contextlib.nullcontext()) as merged:
+                # Página de soportes ya cargada; las regiones llegan agrupadas
+                # por página, así que basta con conservar la actual
+                page_cache = {}
+                
+                for idx, (soporte_page_num, region) in enumerate(soporte_regions):
+                    # Un soporte que falla se informa y se omite sin detener el resto
+                    try:
+                        page = page_cache.get(soporte_page_num)
+                        if page is None:
+                            page_cache.clear()
+                            page = page_cache[soporte_page_num] = soporte_doc.load_page(soporte_page_num)
+
+                        # Extraer imagen de la región del soporte y aplicar OCR
+                        pix = page.get_pixmap(dpi=300, clip=region)
+                        img_bytes = pix.tobytes("png")
+                        image = Image.open(io.BytesIO(img_bytes))
+                        extracted_text = pytesseract.image_to_string(image, lang="spa").upper()
+
+                        self.log(f"Texto extraído del soporte #{idx+1}:\n{extracted_text}")
+                        if "ABONADO" not in extracted_text:
+                            self.log(f"Soporte #{idx+1} rechazado: no contiene 'ABONADO'")
+                            continue
+
+                        valor_soporte = self.extract_valor(extracted_text)
+                        if valor_soporte is None:
+                            self.log(f"Soporte #{idx+1} rechazado: valor no encontrado")
+                            continue
+
+                        # Primer registro sin emparejar con un valor a $100 o menos del soporte
+                        match_pos = next((pos for pos, valor_tb in enumerate(valores)
+                                          if not emparejados[pos] and abs(valor_tb - valor_soporte) <= 100),
+                                         None)
+                        if match_pos is None:
+                            self.log(f"Soporte #{idx+1} rechazado: sin TB coincidente para valor ${valor_soporte:,}")
+                            continue
+                        match_idx = records[match_pos]
+
+                        # insert_pdf no falla con una página inexistente: copiaría la última TB
+                        if match_idx >= tb_pages:
+                            self.log(f"Advertencia: Soporte #{idx+1} rechazado: no hay TB para el registro {match_idx+1}")
+                            continue
+
+                        num_egreso = str(df.at[match_idx, "No Egreso"])
+                        girado_a = str(df.at[match_idx, "Girado a"])
+                        safe_girado_a = _SAFE_RE.sub("", girado_a).strip()
+
+                        if merged is not None:
+                            start_page = merged.page_count
+                            try:
+                                self.append_record(merged, tb_doc, soporte_doc, match_idx,
+                                                   soporte_page_num, region)
+                            except Exception:
+                                # Descartar las páginas que alcanzaron a agregarse
+                                if merged.page_count > start_page:
+                                    merged.delete_pages(from_page=start_page, to_page=merged.page_count - 1)
+                                raise
+                            toc.append([1, f"{num_egreso} - {safe_girado_a}", start_page + 1])
+                        else:
+                            filename = f"{num_egreso} - {safe_girado_a}.pdf"
+                            output_path = os.path.join(self.output_folder, filename)
+                            with fitz.open() as final_doc:
+                                self.append_record(final_doc, tb_doc, soporte_doc, match_idx,
+                                                   soporte_page_num, region)
+                                data = final_doc.tobytes(**PDF_SAVE_OPTIONS)
+                            writer.write(output_path, data)
+
+                        # La TB solo queda emparejada si su PDF llegó a generarse
+                        emparejados[match_pos] = True
+                        self.set_progress(66 + int((idx + 1) / total_soportes * 34))
+                    except OSError:
+                        # Un error de disco afectaría a todos los archivos: se detiene
+                        raise
+                    except Exception as e:
+                        self.failed_records += 1
+                        self.log(f"Error en el soporte #{idx+1}: {e!r}")
+
+                if merged is not None:
+                    if merged.page_count == 0:
+                        self.log("Error: No se emparejó ningún soporte para el PDF único")
+                        return False
+                    merged.set_toc(toc)
+                    writer.write(self.merged_output_path(), merged.tobytes(**PDF_SAVE_OPTIONS))
+
+            df["Emparejado"] = emparejados
+            if self.failed_records:
+                self.log(f"Advertencia: No se pudieron generar {self.failed_records} soportes")
+
+            self.set_progress(100)
             return True
 
         except Exception as e:
             self.log(f"Error al crear PDFs combinados: {str(e)}")
             return False
 
+    def append_record(self, target_doc, tb_doc, soporte_doc, tb_page, soporte_page_num, region):
+        """
+        Agrega al final de un documento una TB y su soporte recortado
+        
+        Args:
+            target_doc (fitz.Document): Documento al que se agregan las páginas
+            tb_doc (fitz.Document): Documento PDF de TBs (una TB por página)
+            soporte_doc (fitz.Document): Documento PDF de soportes
+            tb_page (int): Página de la TB emparejada
+            soporte_page_num (int): Página del PDF de soportes
+            region (fitz.Rect): Región del soporte en la página
+        """
+        target_doc.insert_pdf(tb_doc, from_page=tb_page, to_page=tb_page)
+        new_page = target_doc.new_page(width=region.width, height=region.height)
+        new_page.show_pdf_page(new_page.rect, soporte_doc, soporte_page_num, clip=region)
+
+    def merged_output_path(self):
+        """
+        Ruta del PDF único, nombrado como el Excel de origen. Nunca reemplaza un
+        archivo existente: agrega " (2)", " (3)", ... al nombre si hace falta
+        
+        Returns:
+            str: Ruta libre en la carpeta de salida
+        """
+        stem = os.path.splitext(os.path.basename(self.excel_path))[0]
+        output_path = os.path.join(self.output_folder, f"{stem}.pdf")
+        copy = 2
+        while os.path.exists(output_path):
+            output_path = os.path.join(self.output_folder, f"{stem} ({copy}).pdf")
+            copy += 1
+        return output_path
+
 
 class MainWindow(QMainWindow):
     """
@@ -305,8 +663,24 @@ class MainWindow(QMainWindow):
         self.excel_path = None
         self.output_folder = None
         
-        # Variable para almacenar el worker thread
-        self.worker = None
+        # Trabajos en curso (id -> PDFProcessor) y su último progreso
+        self.workers = {}
+        self.worker_progress = {}
+        self._next_job_id = 1
+        
+        # Los trabajos se encolan en el pool global de hilos. Todo el proceso usa
+        # PyMuPDF, que no admite varios hilos, así que se ejecutan de uno en uno
+        # (esto además evita que dos trabajos escriban la misma carpeta a la vez)
+        self.thread_pool = QThreadPool.globalInstance()
+        self.thread_pool.setMaxThreadCount(1)
+        
+        # Entradas de registro pendientes de mostrar; se vuelcan juntas
+        # para no repintar el área de registro por cada mensaje
+        self._log_buffer = []
+        self._log_timer = QTimer(self)
+        self._log_timer.setSingleShot(True)
+        self._log_timer.setInterval(LOG_FLUSH_INTERVAL_MS)
+        self._log_timer.timeout.connect(self._flush_log)
         
         self.init_ui()
         
@@ -475,6 +849,12 @@ class MainWindow(QMainWindow):
         button_container.addWidget(self.process_button)
         button_container.addStretch(1)
         
+        # Opción para forzar la lectura completa del Excel
+        self.no_cache_checkbox = QCheckBox("No usar caché del Excel")
+        
+        # Opción para generar un solo PDF con marcadores en lugar de uno por soporte
+        self.single_output_checkbox = QCheckBox("Salida única con marcadores")
+        
         # Área de registro
         self.log_label = QLabel("Registro de actividad:")
         self.log_text = QTextEdit()
@@ -484,6 +864,8 @@ class MainWindow(QMainWindow):
         # Agregar al layout
         process_layout.addWidget(progress_label)
         process_layout.addWidget(self.progress_bar)
+        process_layout.addWidget(self.no_cache_checkbox)
+        process_layout.addWidget(self.single_output_checkbox)
         process_layout.addLayout(button_container)
         process_layout.addWidget(self.log_label)
         process_layout.addWidget(self.log_text)
@@ -501,24 +883,44 @@ class MainWindow(QMainWindow):
         
     def log(self, message):
         """Agrega un mensaje al área de registro"""
+        # El registro se inserta como HTML: escapar el texto y conservar los saltos de línea
+        message_html = html.escape(message).replace("\n", "<br>")
+        
         # Añadir formato de color según el tipo de mensaje
         if "Error" in message:
-            formatted_message = f"<span style='color:#e74c3c;'>{message}</span>"
+            formatted_message = f"<span style='color:#e74c3c;'>{message_html}</span>"
         elif "Advertencia" in message:
-            formatted_message = f"<span style='color:#f39c12;'>{message}</span>"
+            formatted_message = f"<span style='color:#f39c12;'>{message_html}</span>"
         elif "completado" in message.lower() or "éxito" in message.lower() or "generado" in message.lower():
-            formatted_message = f"<span style='color:#27ae60;'>{message}</span>"
+            formatted_message = f"<span style='color:#27ae60;'>{message_html}</span>"
         else:
-            formatted_message = message
+            formatted_message = message_html
             
         # Añadir timestamp
         timestamp = datetime.now().strftime("%H:%M:%S")
         entry = f"[{timestamp}] {formatted_message}"
         
-        self.log_text.append(entry)
-        # Desplazarse al final
+        self._log_buffer.append(entry)
+        if not self._log_timer.isActive():
+            self._log_timer.start()
+            
+    def _flush_log(self):
+        """Vuelca al área de registro las entradas pendientes en una sola edición"""
+        self._log_timer.stop()
+        if not self._log_buffer:
+            return
+        entries, self._log_buffer = self._log_buffer, []
+        
+        # Insertar al final, un bloque por entrada: si todo fuera un solo bloque,
+        # Qt tendría que volver a maquetar el registro completo en cada volcado
         cursor = self.log_text.textCursor()
         cursor.movePosition(cursor.End)
+        cursor.beginEditBlock()
+        for entry in entries:
+            if not self.log_text.document().isEmpty():
+                cursor.insertBlock()
+            cursor.insertHtml(entry)
+        cursor.endEditBlock()
         self.log_text.setTextCursor(cursor)
         
     def check_files_selected(self):
@@ -591,66 +993,58 @@ class MainWindow(QMainWindow):
             self.check_files_selected()
             
     def process_files(self):
-        """Inicia el procesamiento de archivos"""
-        # Deshabilitar botón durante el proceso
-        self.process_button.setEnabled(False)
-        self.process_button.setStyleSheet("""
-            QPushButton {
-                background-color: #cccccc;
-                color: #666666;
-                font-size: 14px;
-            }
-        """)
+        """Encola un trabajo con los archivos seleccionados"""
+        job_id = self._next_job_id
+        self._next_job_id += 1
         
-        # Restablecer barra de progreso
-        self.progress_bar.setValue(0)
-        
-        # Crear worker thread
-        self.worker = PDFProcessor(
+        # Crear trabajo
+        worker = PDFProcessor(
             self.tb_path,
             self.soporte_path,
             self.excel_path,
-            self.output_folder
+            self.output_folder,
+            use_cache=not self.no_cache_checkbox.isChecked(),
+            single_output=self.single_output_checkbox.isChecked()
         )
+        self.workers[job_id] = worker
+        self.worker_progress[job_id] = 0
+        self.update_progress(job_id, 0)
         
         # Conectar señales
-        self.worker.progress_update.connect(self.update_progress)
-        self.worker.log_update.connect(self.log)
-        self.worker.finished_signal.connect(self.processing_finished)
+        worker.progress_update.connect(lambda value, job=job_id: self.update_progress(job, value))
+        worker.log_update.connect(lambda message, job=job_id: self.log(f"[#{job}] {message}"))
+        worker.finished_signal.connect(
+            lambda success, message, job=job_id: self.processing_finished(job, success, message))
         
-        # Iniciar procesamiento
-        self.log("Iniciando proceso...")
-        self.worker.start()
+        # Encolar procesamiento
+        self.log(f"[#{job_id}] Iniciando proceso...")
+        self.thread_pool.start(worker)
         
-    def update_progress(self, value):
-        """Actualiza la barra de progreso"""
-        self.progress_bar.setValue(value)
+    def update_progress(self, job_id, value):
+        """Actualiza la barra de progreso con el promedio de los trabajos en curso"""
+        self.worker_progress[job_id] = value
+        self.progress_bar.setValue(int(sum(self.worker_progress.values()) / len(self.worker_progress)))
         
-    def processing_finished(self, success, message):
-        """Maneja la finalización del procesamiento"""
-        # Asegurar que la barra de progreso esté al 100%
-        self.progress_bar.setValue(100)
+    def processing_finished(self, job_id, success, message):
+        """Maneja la finalización de un trabajo"""
+        # Mostrar el registro pendiente antes del mensaje final
+        self._flush_log()
         
-        # Habilitar botón nuevamente
-        self.process_button.setEnabled(True)
-        self.process_button.setStyleSheet("""
-            QPushButton {
-                background-color: #2ecc71;
-                font-size: 14px;
-            }
-            QPushButton:hover {
-                background-color: #27ae60;
-            }
-        """)
+        # Limpiar el trabajo terminado
+        self.workers.pop(job_id, None)
+        self.worker_progress.pop(job_id, None)
+        
+        # Asegurar que la barra de progreso esté al 100% si no quedan trabajos
+        if self.worker_progress:
+            self.progress_bar.setValue(int(sum(self.worker_progress.values()) / len(self.worker_progress)))
+        else:
+            self.progress_bar.setValue(100)
         
         # Mostrar mensaje de resultado
         if success:
-            QMessageBox.information(self, "Proceso Completado", message)
+            QMessageBox.information(self, "Proceso Completado", f"[#{job_id}] {message}")
         else:
-            QMessageBox.critical(self, "Error", message)
-            
-        # Limpiar worker
-        self.worker = None
+            QMessageBox.critical(self, "Error", f"[#{job_id}] {message}")
 
 
 def main():